@@ -6,13 +6,16 @@ import warnings
 import re
 import tempfile
 import subprocess
+import sysconfig
 import glob
+from unittest import mock
 
 import torch.testing._internal.common_utils as common
 import torch
 import torch.backends.cudnn
 import torch.utils.cpp_extension
 from torch.utils.cpp_extension import CUDA_HOME, ROCM_HOME
+from torch.utils._cpp_extension_versioner import ExtensionVersioner
 
 
 TEST_CUDA = torch.cuda.is_available() and CUDA_HOME is not None
@@ -99,6 +102,67 @@ class TestCppExtensionJIT(common.TestCase):
         self.assertEqual(doubler.get().sum(), 4)
         self.assertEqual(doubler.forward().sum(), 8)
 
+    def test_jit_compile_extension_unity_build(self):
+        def compile(unity_build):
+            return torch.utils.cpp_extension.load(
+                name="jit_extension_unity_build",
+                sources=[
+                    "cpp_extensions/jit_extension.cpp",
+                    "cpp_extensions/jit_extension2.cpp",
+                ],
+                extra_include_paths=["cpp_extensions"],
+                verbose=True,
+                unity_build=unity_build,
+            )
+
+        module = compile(unity_build=False)
+        build_directory = os.path.dirname(module.__file__)
+        self.assertFalse(os.path.exists(os.path.join(build_directory, "unity.cpp")))
+
+        # Switching to a unity build of the same extension must not be
+        # mistaken for an unmodified reload.
+        module = compile(unity_build=True)
+        self.assertEqual(module.__name__, "jit_extension_unity_build_v1")
+        self.assertTrue(os.path.exists(os.path.join(build_directory, "unity.cpp")))
+
+        x = torch.randn(4, 4)
+        y = torch.randn(4, 4)
+        self.assertEqual(module.tanh_add(x, y), x.tanh() + y.tanh())
+        self.assertEqual(module.exp_add(x, y), x.exp() + y.exp())
+
+        # And neither must switching back.
+        module = compile(unity_build=False)
+        self.assertEqual(module.__name__, "jit_extension_unity_build_v2")
+
+    def test_jit_compile_extension_with_same_source_file_names(self):
+        source_directory = tempfile.mkdtemp()
+        sources = []
+        for subdirectory, source in [
+            ("first", "#include <torch/extension.h>\n"
+                      "int second();\n"
+                      "int first() { return 1; }\n"
+                      "PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {\n"
+                      "  m.def(\"first\", &first);\n"
+                      "  m.def(\"second\", &second);\n"
+                      "}\n"),
+            ("second", "int second() { return 2; }\n"),
+        ]:
+            os.mkdir(os.path.join(source_directory, subdirectory))
+            sources.append(os.path.join(source_directory, subdirectory, "extension.cpp"))
+            with open(sources[-1], "w") as source_file:
+                source_file.write(source)
+
+        try:
+            module = torch.utils.cpp_extension.load(
+                name="jit_extension_same_source_file_names",
+                sources=sources,
+                verbose=True,
+            )
+            self.assertEqual(module.first(), 1)
+            self.assertEqual(module.second(), 2)
+        finally:
+            shutil.rmtree(source_directory)
+
     @unittest.skipIf(not TEST_CUDA, "CUDA not found")
     def test_jit_cuda_extension(self):
         # NOTE: The name of the extension must equal the name of the module.
@@ -430,6 +494,99 @@ class TestCppExtensionJIT(common.TestCase):
         module = compile("int f() { return 789; }")
         self.assertEqual(module.f(), 789)
 
+    def test_jit_extension_build_step_skipped_when_manifest_matches(self):
+        def compile():
+            return torch.utils.cpp_extension.load_inline(
+                name="manifest_jit_extension",
+                cpp_sources="int f() { return 123; }",
+                functions="f",
+                verbose=True,
+            )
+
+        module = compile()
+        self.assertEqual(module.f(), 123)
+        build_directory = os.path.dirname(module.__file__)
+        self.assertTrue(os.path.exists(os.path.join(
+            build_directory, torch.utils.cpp_extension.JIT_EXTENSION_MANIFEST)))
+
+        # Pretend to be a fresh process, which has no in-memory record of the
+        # build above. Removing the ninja file proves the build step is skipped.
+        old_versioner = torch.utils.cpp_extension.JIT_EXTENSION_VERSIONER
+        torch.utils.cpp_extension.JIT_EXTENSION_VERSIONER = ExtensionVersioner()
+        try:
+            os.remove(os.path.join(build_directory, "build.ninja"))
+            module = compile()
+            self.assertEqual(module.f(), 123)
+            self.assertFalse(os.path.exists(os.path.join(build_directory, "build.ninja")))
+        finally:
+            torch.utils.cpp_extension.JIT_EXTENSION_VERSIONER = old_versioner
+
+    def test_jit_extension_rebuilt_when_included_header_changes(self):
+        include_directory = tempfile.mkdtemp()
+        header_path = os.path.join(include_directory, "manifest_header.h")
+        with open(header_path, "w") as header:
+            header.write("#define VALUE 123\n")
+
+        def compile():
+            return torch.utils.cpp_extension.load_inline(
+                name="manifest_header_jit_extension",
+                cpp_sources='#include "manifest_header.h"\nint f() { return VALUE; }',
+                functions="f",
+                extra_include_paths=[include_directory],
+                verbose=True,
+            )
+
+        try:
+            module = compile()
+            self.assertEqual(module.f(), 123)
+            build_directory = os.path.dirname(module.__file__)
+
+            # Pretend to be a fresh process after editing the header. The build
+            # step must run again, which recreates the ninja file.
+            old_versioner = torch.utils.cpp_extension.JIT_EXTENSION_VERSIONER
+            torch.utils.cpp_extension.JIT_EXTENSION_VERSIONER = ExtensionVersioner()
+            try:
+                os.remove(os.path.join(build_directory, "build.ninja"))
+                with open(header_path, "w") as header:
+                    header.write("#define VALUE 456\n")
+                compile()
+                self.assertTrue(os.path.exists(os.path.join(build_directory, "build.ninja")))
+            finally:
+                torch.utils.cpp_extension.JIT_EXTENSION_VERSIONER = old_versioner
+        finally:
+            shutil.rmtree(include_directory)
+
+    @unittest.skipIf(IS_WINDOWS, "creating symlinks requires privileges on Windows")
+    def test_jit_extension_rebuilt_when_python_include_directory_changes(self):
+        def compile():
+            return torch.utils.cpp_extension.load_inline(
+                name="manifest_python_jit_extension",
+                cpp_sources="int f() { return 123; }",
+                functions="f",
+                verbose=True,
+            )
+
+        module = compile()
+        build_directory = os.path.dirname(module.__file__)
+
+        # Pretend to be a fresh process of another interpreter, whose headers
+        # live elsewhere. The build step must run again, which recreates the
+        # ninja file.
+        python_directory = tempfile.mkdtemp()
+        paths = sysconfig.get_paths()
+        os.symlink(paths["include"], os.path.join(python_directory, "include"))
+        paths["include"] = os.path.join(python_directory, "include")
+        old_versioner = torch.utils.cpp_extension.JIT_EXTENSION_VERSIONER
+        torch.utils.cpp_extension.JIT_EXTENSION_VERSIONER = ExtensionVersioner()
+        try:
+            os.remove(os.path.join(build_directory, "build.ninja"))
+            with mock.patch("sysconfig.get_paths", return_value=paths):
+                compile()
+            self.assertTrue(os.path.exists(os.path.join(build_directory, "build.ninja")))
+        finally:
+            torch.utils.cpp_extension.JIT_EXTENSION_VERSIONER = old_versioner
+            shutil.rmtree(python_directory)
+
     @dont_wipe_extensions_build_folder
     @common.skipIfRocm
     def test_cpp_frontend_module_has_same_output_as_python(self, dtype=torch.double):
@@ -630,13 +787,15 @@ class TestCppExtensionJIT(common.TestCase):
         torch::Tensor func(torch::Tensor x) { return x; }
         static torch::RegisterOperators r("test::func", &func);
         """
-        torch.utils.cpp_extension.load_inline(
+        library_path = torch.utils.cpp_extension.load_inline(
             name="is_python_module",
             cpp_sources=source,
             functions="func",
             verbose=True,
             is_python_module=False,
         )
+        self.assertTrue(os.path.isfile(library_path))
+        self.assertIn(os.path.realpath(library_path), torch.ops.loaded_libraries)
         self.assertEqual(torch.ops.test.func(torch.eye(5)), torch.eye(5))
 
     def test_set_default_type_also_changes_aten_default_type(self):
@@ -1,10 +1,13 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 import copy
-import glob
-import imp
+import functools
+import hashlib
+import importlib.util
+import json
 import os
 import re
 import setuptools
+import shutil
 import subprocess
 import sys
 import sysconfig
@@ -23,27 +26,20 @@ from setuptools.command.build_ext import build_ext
 
 IS_WINDOWS = sys.platform == 'win32'
 
+@functools.lru_cache(maxsize=1)
 def _find_cuda_home():
     '''Finds the CUDA install path.'''
     # Guess #1
     cuda_home = os.environ.get('CUDA_HOME') or os.environ.get('CUDA_PATH')
     if cuda_home is None:
         # Guess #2
-        try:
-            which = 'where' if IS_WINDOWS else 'which'
-            with open(os.devnull, 'w') as devnull:
-                nvcc = subprocess.check_output([which, 'nvcc'],
-                                               stderr=devnull).decode().rstrip('\r\n')
-                cuda_home = os.path.dirname(os.path.dirname(nvcc))
-        except Exception:
+        nvcc = shutil.which('nvcc')
+        if nvcc is not None:
+            cuda_home = os.path.dirname(os.path.dirname(nvcc))
+        else:
             # Guess #3
             if IS_WINDOWS:
-                cuda_homes = glob.glob(
-                    'C:/Program Files/NVIDIA GPU Computing Toolkit/CUDA/v*.*')
-                if len(cuda_homes) == 0:
-                    cuda_home = ''
-                else:
-                    cuda_home = cuda_homes[0]
+                cuda_home = _find_newest_windows_cuda_home()
             else:
                 cuda_home = '/usr/local/cuda'
             if not os.path.exists(cuda_home):
@@ -52,20 +48,36 @@ def _find_cuda_home():
         print("No CUDA runtime is found, using CUDA_HOME='{}'".format(cuda_home))
     return cuda_home
 
+def _find_newest_windows_cuda_home():
+    '''
+    Finds the newest CUDA toolkit installed in the default location on Windows,
+    or returns '' if there is none.
+    '''
+    versions = {}
+    try:
+        with os.scandir('C:/Program Files/NVIDIA GPU Computing Toolkit/CUDA') as entries:
+            for entry in entries:
+                # Toolkits are installed into e.g. 'v10.2'.
+                match = re.match(r'v(\d+)\.(\d+)$', entry.name)
+                if match is not None and entry.is_dir():
+                    versions[tuple(map(int, match.groups()))] = entry.path
+    except OSError:
+        return ''
+    return versions[max(versions)] if versions else ''
+
 def _find_rocm_home():
     '''Finds the ROCm install path.'''
     # Guess #1
     rocm_home = os.environ.get('ROCM_HOME') or os.environ.get('ROCM_PATH')
     if rocm_home is None:
         # Guess #2
-        try:
-            hipcc = subprocess.check_output(
-                ['which', 'hipcc'], stderr=subprocess.DEVNULL).decode().rstrip('\r\n')
+        hipcc = shutil.which('hipcc')
+        if hipcc is not None:
             # this will be either <ROCM_HOME>/hip/bin/hipcc or <ROCM_HOME>/bin/hipcc
             rocm_home = os.path.dirname(os.path.dirname(hipcc))
             if os.path.basename(rocm_home) == 'hip':
                 rocm_home = os.path.dirname(rocm_home)
-        except Exception:
+        else:
             # Guess #3
             rocm_home = '/opt/rocm'
             if not os.path.exists(rocm_home):
@@ -128,7 +140,12 @@ with compiling PyTorch from source.
 ROCM_HOME = _find_rocm_home()
 MIOPEN_HOME = _join_rocm_home('miopen') if ROCM_HOME else None
 IS_HIP_EXTENSION = True if ((ROCM_HOME is not None) and (torch.version.hip is not None)) else False
-CUDA_HOME = _find_cuda_home()
+# CUDA_HOME is looked up lazily (see `__getattr__` below), so that importing
+# this module does not pay for searching the CUDA install ahead of time.
+# Python < 3.7 does not support module-level `__getattr__`, so it is looked up
+# eagerly there.
+if sys.version_info < (3, 7):
+    CUDA_HOME = _find_cuda_home()
 CUDNN_HOME = os.environ.get('CUDNN_HOME') or os.environ.get('CUDNN_PATH')
 # PyTorch releases have the version pattern major.minor.patch, whereas when
 # PyTorch is built from source, we append the git commit hash, which gives
@@ -144,6 +161,10 @@ COMMON_NVCC_FLAGS = [
     '--expt-relaxed-constexpr'
 ]
 
+# Extensions of the source files compiled with nvcc (or hipcc) rather than the
+# C++ compiler. See `_is_cuda_file`.
+_CUDA_FILE_EXTENSIONS = frozenset(['.cu', '.cuh', '.hip'] if IS_HIP_EXTENSION else ['.cu', '.cuh'])
+
 COMMON_HIPCC_FLAGS = [
     '-fPIC',
     '-D__HIP_PLATFORM_HCC__=1',
@@ -154,6 +175,11 @@ COMMON_HIPCC_FLAGS = [
 
 JIT_EXTENSION_VERSIONER = ExtensionVersioner()
 
+# Name of the file in which `load()` persists, per build directory, a digest of
+# the inputs each extension library was last built from. This lets processes
+# other than the one that built an extension skip its build step entirely.
+JIT_EXTENSION_MANIFEST = '.torch_ext_manifest.json'
+
 
 def _is_binary_build():
     return not BUILT_FROM_SOURCE_VERSION_PATTERN.match(torch.version.__version__)
@@ -190,9 +216,8 @@ def check_compiler_ok_for_platform(compiler):
     '''
     if IS_WINDOWS:
         return True
-    which = subprocess.check_output(['which', compiler], stderr=subprocess.STDOUT)
     # Use os.path.realpath to resolve any symlinks, in particular from 'c++' to e.g. 'g++'.
-    compiler_path = os.path.realpath(which.decode().strip())
+    compiler_path = os.path.realpath(shutil.which(compiler) or compiler)
     return any(name in compiler_path for name in _accepted_compilers_for_platform())
 
 
@@ -213,6 +238,16 @@ def check_compiler_abi_compatibility(compiler):
     if os.environ.get('TORCH_DONT_CHECK_COMPILER_ABI') in ['ON', '1', 'YES', 'TRUE', 'Y']:
         return True
 
+    # The check spawns the compiler, so only do it once per compiler (for as
+    # long as the executable isn't replaced, e.g. by a compiler upgrade).
+    compiler_path = shutil.which(compiler)
+    compiler_mtime = None if compiler_path is None else os.path.getmtime(compiler_path)
+    return _check_compiler_abi_compatibility(compiler, compiler_path, compiler_mtime)
+
+
+@functools.lru_cache(maxsize=8)
+def _check_compiler_abi_compatibility(compiler, compiler_path, compiler_mtime):
+    # `compiler_path` and `compiler_mtime` only serve as part of the cache key.
     # First check if the compiler is one of the expected ones for the particular platform.
     if not check_compiler_ok_for_platform(compiler):
         warnings.warn(WRONG_COMPILER_WARNING.format(
@@ -333,9 +368,10 @@ class BuildExtension(build_ext, object):
                 cflags.append(cpp_flag)
 
         def unix_cuda_flags(cflags):
-            return (COMMON_NVCC_FLAGS +
-                    ['--compiler-options', "'-fPIC'"] +
-                    cflags + _get_cuda_arch_flags(cflags))
+            cflags = (COMMON_NVCC_FLAGS +
+                      _get_nvcc_fpic_flags(cflags) +
+                      cflags + _get_cuda_arch_flags(cflags))
+            return cflags + _get_nvcc_thread_flags(_join_cuda_home('bin', 'nvcc'), cflags)
 
         def unix_wrap_single_compile(obj, src, ext, cc_args, extra_postargs, pp_opts):
             # Copy before we make any modifications.
@@ -428,8 +464,9 @@ class BuildExtension(build_ext, object):
             return objects
 
         def win_cuda_flags(cflags):
-            return (COMMON_NVCC_FLAGS +
-                    cflags + _get_cuda_arch_flags(cflags))
+            cflags = (COMMON_NVCC_FLAGS +
+                      cflags + _get_cuda_arch_flags(cflags))
+            return cflags + _get_nvcc_thread_flags(_join_cuda_home('bin', 'nvcc'), cflags)
 
         def win_wrap_single_compile(sources,
                                     output_dir=None,
@@ -599,6 +636,10 @@ class BuildExtension(build_ext, object):
         return ext_filename
 
     def _check_abi(self):
+        # The compiler does not change between calls to build_extensions(), so
+        # only determine and check it once.
+        if getattr(self, '_cached_cxx', None) is not None:
+            return
         # On some platforms, like Windows, compiler_cxx is not available.
         if hasattr(self.compiler, 'compiler_cxx'):
             compiler = self.compiler.compiler_cxx[0]
@@ -607,6 +648,7 @@ class BuildExtension(build_ext, object):
         else:
             compiler = os.environ.get('CXX', 'c++')
         check_compiler_abi_compatibility(compiler)
+        self._cached_cxx = compiler
 
     def _add_compile_flag(self, extension, flag):
         extension.extra_compile_args = copy.deepcopy(extension.extra_compile_args)
@@ -817,7 +859,8 @@ def load(name,
          verbose=False,
          with_cuda=None,
          is_python_module=True,
-         keep_intermediates=True):
+         keep_intermediates=True,
+         unity_build=False):
     '''
     Loads a PyTorch C++ extension just-in-time (JIT).
 
@@ -836,12 +879,26 @@ def load(name,
     argument to this function is supplied, it overrides the entire path, i.e.
     the library will be compiled into that folder directly.
 
+    A digest of the sources, flags and toolchain the library was built from is
+    recorded in the build directory, along with the modification times of the
+    headers the sources included. If a later call (from this or any other
+    process) finds a matching digest, unmodified headers and an existing
+    library, the build step is skipped entirely and the existing library is
+    loaded. Set the ``TORCH_EXTENSION_FORCE_REBUILD`` environment variable to
+    ``1`` to run the build step regardless (ninja will then recompile whatever
+    changed).
+
     To compile the sources, the default system compiler (``c++``) is used,
     which can be overridden by setting the ``CXX`` environment variable. To pass
     additional arguments to the compilation process, ``extra_cflags`` or
     ``extra_ldflags`` can be provided. For example, to compile your extension
     with optimizations, pass ``extra_cflags=['-O3']``. You can also use
-    ``extra_cflags`` to pass further include directories.
+    ``extra_cflags`` to pass further include directories. Setting the
+    ``USE_CCACHE`` environment variable to ``1`` makes all compiler
+    invocations go through `ccache <https://ccache.dev/>`_. Since ccache keys
+    its cache on the preprocessed source and compiler flags rather than on the
+    build directory, this also lets extensions with different names reuse the
+    object files of sources they share.
 
     CUDA support with mixed compilation is provided. Simply pass CUDA source
     files (``.cu`` or ``.cuh``) along with other sources. Such files will be
@@ -851,7 +908,9 @@ def load(name,
     ``extra_cuda_cflags``, just like with ``extra_cflags`` for C++. Various
     heuristics for finding the CUDA install directory are used, which usually
     work fine. If not, setting the ``CUDA_HOME`` environment variable is the
-    safest option.
+    safest option. With CUDA 11.2 or newer, nvcc compiles the device code for
+    multiple architectures in parallel; the number of threads it uses can be
+    set via the ``TORCH_NVCC_THREADS`` environment variable.
 
     Args:
         name: The name of the extension to build. This MUST be the same as the
@@ -872,13 +931,19 @@ def load(name,
             and libraries to be included.
         is_python_module: If ``True`` (default), imports the produced shared
             library as a Python module. If ``False``, loads it into the process
-            as a plain dynamic library.
+            as a plain dynamic library (e.g. one registering TorchScript custom
+            operators), without importing it as a module.
+        unity_build: If ``True``, the C++ (but not CUDA) sources are compiled
+            as a single translation unit that includes all of them, which
+            is faster for many small sources. The sources must not define
+            conflicting internal names (e.g. ``static`` functions or anonymous
+            namespace members) for this to work. Defaults to ``False``.
 
     Returns:
         If ``is_python_module`` is ``True``, returns the loaded PyTorch
         extension as a Python module. If ``is_python_module`` is ``False``
-        returns nothing (the shared library is loaded into the process as a side
-        effect).
+        returns the path to the shared library, which is also loaded into the
+        process as a side effect.
 
     Example:
         >>> from torch.utils.cpp_extension import load
@@ -899,7 +964,8 @@ def load(name,
         verbose,
         with_cuda,
         is_python_module,
-        keep_intermediates=keep_intermediates)
+        keep_intermediates=keep_intermediates,
+        unity_build=unity_build)
 
 
 def load_inline(name,
@@ -1022,8 +1088,7 @@ def load_inline(name,
         cpp_sources += module_def
 
     cpp_source_path = os.path.join(build_directory, 'main.cpp')
-    with open(cpp_source_path, 'w') as cpp_source_file:
-        cpp_source_file.write('\n'.join(cpp_sources))
+    _maybe_write(cpp_source_path, '\n'.join(cpp_sources))
 
     sources = [cpp_source_path]
 
@@ -1033,8 +1098,7 @@ def load_inline(name,
         cuda_sources.insert(2, '#include <cuda_runtime.h>')
 
         cuda_source_path = os.path.join(build_directory, 'cuda.cu')
-        with open(cuda_source_path, 'w') as cuda_source_file:
-            cuda_source_file.write('\n'.join(cuda_sources))
+        _maybe_write(cuda_source_path, '\n'.join(cuda_sources))
 
         sources.append(cuda_source_path)
 
@@ -1062,15 +1126,18 @@ def _jit_compile(name,
                  verbose,
                  with_cuda,
                  is_python_module,
-                 keep_intermediates=True):
+                 keep_intermediates=True,
+                 unity_build=False):
     if with_cuda is None:
         with_cuda = any(map(_is_cuda_file, sources))
     with_cudnn = any(['cudnn' in f for f in extra_ldflags or []])
+    build_arguments = [extra_cflags, extra_cuda_cflags, extra_ldflags, extra_include_paths,
+                       ['unity_build'] if unity_build else None]
     old_version = JIT_EXTENSION_VERSIONER.get_version(name)
     version = JIT_EXTENSION_VERSIONER.bump_version_if_changed(
         name,
         sources,
-        build_arguments=[extra_cflags, extra_cuda_cflags, extra_ldflags, extra_include_paths],
+        build_arguments=build_arguments,
         build_directory=build_directory,
         with_cuda=with_cuda
     )
@@ -1080,38 +1147,65 @@ def _jit_compile(name,
                   'Bumping to version {0} and re-building as {1}_v{0}...'.format(version, name))
         name = '{}_v{}'.format(name, version)
 
+    # The in-memory versioner only knows about builds done by this process. To
+    # also skip builds done by other processes, compare against the digest
+    # persisted in the build directory's manifest. TORCH_EXTENSION_FORCE_REBUILD
+    # makes us ignore the manifest, though we still use a build that another
+    # process completes while we wait for the baton.
+    digest = None
     if version != old_version:
+        digest = _get_jit_build_digest(name, sources, build_arguments, with_cuda)
+    force_rebuild = os.environ.get('TORCH_EXTENSION_FORCE_REBUILD') in ['ON', '1', 'YES', 'TRUE', 'Y']
+    if version == old_version:
+        if verbose:
+            print('No modifications detected for re-loaded extension '
+                  'module {}, skipping build step...'.format(name))
+    elif not force_rebuild and _is_jit_build_up_to_date(name, build_directory, digest):
+        if verbose:
+            print('Found an up-to-date build of extension module {}, '
+                  'skipping build step...'.format(name))
+    else:
         baton = FileBaton(os.path.join(build_directory, 'lock'))
-        if baton.try_acquire():
-            try:
-                with GeneratedFileCleaner(keep_intermediates=keep_intermediates) as clean_ctx:
-                    if IS_HIP_EXTENSION and (with_cuda or with_cudnn):
-                        hipify_python.hipify(
-                            project_directory=build_directory,
-                            output_directory=build_directory,
-                            includes=os.path.join(build_directory, '*'),
-                            extra_files=[os.path.abspath(s) for s in sources],
-                            show_detailed=verbose,
-                            is_pytorch_extension=True,
-                            clean_ctx=clean_ctx
-                        )
-                    _write_ninja_file_and_build_library(
-                        name=name,
-                        sources=sources,
-                        extra_cflags=extra_cflags or [],
-                        extra_cuda_cflags=extra_cuda_cflags or [],
-                        extra_ldflags=extra_ldflags or [],
-                        extra_include_paths=extra_include_paths or [],
-                        build_directory=build_directory,
-                        verbose=verbose,
-                        with_cuda=with_cuda)
-            finally:
-                baton.release()
-        else:
+        while True:
+            if baton.try_acquire():
+                try:
+                    # Another process may have built the library between our
+                    # check above and acquiring the baton.
+                    if force_rebuild or not _is_jit_build_up_to_date(name, build_directory, digest):
+                        with GeneratedFileCleaner(keep_intermediates=keep_intermediates) as clean_ctx:
+                            if IS_HIP_EXTENSION and (with_cuda or with_cudnn):
+                                hipify_python.hipify(
+                                    project_directory=build_directory,
+                                    output_directory=build_directory,
+                                    includes=os.path.join(build_directory, '*'),
+                                    extra_files=[os.path.abspath(s) for s in sources],
+                                    show_detailed=verbose,
+                                    is_pytorch_extension=True,
+                                    clean_ctx=clean_ctx
+                                )
+                            _write_ninja_file_and_build_library(
+                                name=name,
+                                sources=sources,
+                                extra_cflags=extra_cflags or [],
+                                extra_cuda_cflags=extra_cuda_cflags or [],
+                                extra_ldflags=extra_ldflags or [],
+                                extra_include_paths=extra_include_paths or [],
+                                build_directory=build_directory,
+                                verbose=verbose,
+                                with_cuda=with_cuda,
+                                unity_build=unity_build)
+                            _update_jit_manifest(
+                                name, build_directory, digest, _get_ninja_build_dependencies(build_directory))
+                finally:
+                    baton.release()
+                break
             baton.wait()
-    elif verbose:
-        print('No modifications detected for re-loaded extension '
-              'module {}, skipping build step...'.format(name))
+            # Whoever held the baton has built the library for us, unless their
+            # build failed. In that case we try again ourselves rather than
+            # importing a library that does not exist, so that the build error
+            # is also reported in this process.
+            if _is_jit_build_up_to_date(name, build_directory, digest):
+                break
 
     if verbose:
         print('Loading extension module {}...'.format(name))
@@ -1170,7 +1264,8 @@ def _write_ninja_file_and_build_library(
         extra_include_paths,
         build_directory,
         verbose,
-        with_cuda):
+        with_cuda,
+        unity_build=False):
     verify_ninja_availability()
     if IS_WINDOWS:
         compiler = os.environ.get('CXX', 'cl')
@@ -1188,7 +1283,8 @@ def _write_ninja_file_and_build_library(
         print(
             'Emitting ninja build file {}...'.format(build_file_path))
     # NOTE: Emitting a new ninja build file does not cause re-compilation if
-    # the sources did not change, so it's ok to re-emit (and it's fast).
+    # the sources did not change, so it's ok to re-emit (and it's fast). The
+    # file is only actually written if its content changed.
     _write_ninja_file_to_build_library(
         path=build_file_path,
         name=name,
@@ -1197,7 +1293,8 @@ def _write_ninja_file_and_build_library(
         extra_cuda_cflags=extra_cuda_cflags or [],
         extra_ldflags=extra_ldflags or [],
         extra_include_paths=extra_include_paths or [],
-        with_cuda=with_cuda)
+        with_cuda=with_cuda,
+        unity_build=unity_build)
 
     if verbose:
         print('Building extension module {}...'.format(name))
@@ -1207,6 +1304,21 @@ def _write_ninja_file_and_build_library(
         error_prefix="Error building extension '{}'".format(name))
 
 
+def _get_compiler_launcher():
+    '''
+    Returns the path to ``ccache`` if compiler invocations should go through
+    it, else ``None``. Using ccache is opted into by setting the ``USE_CCACHE``
+    environment variable, and is not supported on Windows.
+    '''
+    if IS_WINDOWS or os.environ.get('USE_CCACHE') not in ['ON', '1', 'YES', 'TRUE', 'Y']:
+        return None
+    ccache = shutil.which('ccache')
+    if ccache is None:
+        warnings.warn('USE_CCACHE is set, but ccache could not be found. '
+                      'Compiling without it.')
+    return ccache
+
+
 def _is_ninja_available():
     with open(os.devnull, 'wb') as devnull:
         try:
@@ -1344,6 +1456,72 @@ def _get_cuda_arch_flags(cflags=None):
     return list(set(flags))
 
 
+@functools.lru_cache(maxsize=None)
+def _get_nvcc_version(nvcc):
+    '''
+    Returns the CUDA release of the given nvcc executable as a ``(major,
+    minor)`` tuple, or ``None`` if it cannot be determined.
+    '''
+    try:
+        output = subprocess.check_output([nvcc, '--version'], stderr=subprocess.STDOUT)
+    except Exception:
+        return None
+    match = re.search(r'release (\d+)\.(\d+)', output.decode())
+    return None if match is None else tuple(map(int, match.groups()))
+
+
+def _get_nvcc_thread_flags(nvcc, cflags):
+    '''
+    Determine the flags making nvcc compile the device code for the different
+    architectures in ``cflags`` in parallel, which is supported from CUDA 11.2
+    onwards.
+
+    One thread per architecture is used, up to the number of CPUs. This can be
+    overridden by setting the ``TORCH_NVCC_THREADS`` environment variable.
+    '''
+    # The user may already have asked for a specific number of threads.
+    if any(flag in ['-t', '--threads'] or flag.startswith('--threads=') for flag in cflags):
+        return []
+    version = _get_nvcc_version(nvcc)
+    if version is None or version < (11, 2):
+        return []
+
+    num_threads = os.environ.get('TORCH_NVCC_THREADS')
+    if num_threads is not None and num_threads.isdigit():
+        return ['--threads', num_threads]
+    num_arches = sum(1 for flag in cflags if flag.startswith(('-gencode', '--generate-code')))
+    num_threads = min(num_arches, os.cpu_count() or 1)
+    if num_threads <= 1:
+        return []
+    return ['--threads', str(num_threads)]
+
+
+def _get_nvcc_thread_count(cflags):
+    '''
+    Returns the number of threads nvcc uses when called with ``cflags``.
+    '''
+    for i, flag in enumerate(cflags):
+        if flag in ['-t', '--threads'] and i + 1 < len(cflags):
+            value = cflags[i + 1]
+        elif flag.startswith('--threads='):
+            value = flag.split('=', 1)[1]
+        else:
+            continue
+        if not value.isdigit():
+            return 1
+        # 0 means "one thread per CPU".
+        return int(value) or os.cpu_count() or 1
+    return 1
+
+
+def _get_nvcc_fpic_flags(cflags):
+    # nvcc needs to forward -fPIC to the host compiler, unless the user already
+    # did so as part of `cflags` (e.g. via `-Xcompiler -fPIC`).
+    if any('-fPIC' in flag for flag in cflags):
+        return []
+    return ['--compiler-options', "'-fPIC'"]
+
+
 def _get_rocm_arch_flags(cflags=None):
     # If cflags is given, there may already be user-provided arch flags in it
     # (from `extra_compile_args`)
@@ -1379,6 +1557,136 @@ def _get_build_directory(name, verbose):
     return build_directory
 
 
+def _get_library_file_name(name):
+    ext = 'pyd' if IS_WINDOWS else 'so'
+    return '{}.{}'.format(name, ext)
+
+
+def _get_executable_identity(executable):
+    # Rather than running the executable to ask for its version, identify it by
+    # where it resolves to and when it was installed, which changes whenever
+    # it is upgraded or a different one is selected (e.g. via alternatives).
+    executable_path = shutil.which(executable)
+    if executable_path is None:
+        return executable
+    executable_path = os.path.realpath(executable_path)
+    return executable_path, os.path.getmtime(executable_path)
+
+
+def _get_jit_build_digest(name, sources, build_arguments, with_cuda):
+    '''
+    Computes a digest of everything the library built for the extension module
+    ``name`` depends on: the contents of its sources, the build arguments, the
+    compilers, the resolved GPU architectures, the Python and PyTorch include
+    paths and the PyTorch version and ABI.
+
+    Headers included by the sources are not part of the digest. Instead, the
+    manifest records the modification times of all dependencies ninja found
+    for the build, see ``_is_jit_build_up_to_date``.
+    '''
+    if IS_WINDOWS:
+        compiler = os.environ.get('CXX', 'cl')
+    else:
+        compiler = os.environ.get('CXX', 'c++')
+    cuda_arch_flags = None
+    nvcc = None
+    if with_cuda and IS_HIP_EXTENSION:
+        cuda_arch_flags = _get_rocm_arch_flags(build_arguments[1])
+        nvcc = _get_executable_identity(_join_rocm_home('bin', 'hipcc'))
+    elif with_cuda:
+        # Without TORCH_CUDA_ARCH_LIST, this depends on the visible GPU.
+        cuda_arch_flags = _get_cuda_arch_flags()
+        nvcc = _get_executable_identity(_join_cuda_home('bin', 'nvcc'))
+    hasher = hashlib.sha1()
+    for source in sources:
+        with open(source, 'rb') as source_file:
+            hasher.update(source_file.read())
+    hasher.update(repr((
+        name,
+        [os.path.abspath(source) for source in sources],
+        build_arguments,
+        with_cuda,
+        sorted(cuda_arch_flags) if cuda_arch_flags is not None else None,
+        _get_executable_identity(compiler),
+        nvcc,
+        include_paths(with_cuda),
+        sysconfig.get_paths()['include'],
+        tuple(sys.version_info),
+        torch._C._GLIBCXX_USE_CXX11_ABI,
+        torch.version.__version__,
+    )).encode())
+    return hasher.hexdigest()
+
+
+def _read_jit_manifest(build_directory):
+    try:
+        with open(os.path.join(build_directory, JIT_EXTENSION_MANIFEST)) as manifest_file:
+            return json.load(manifest_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def _get_ninja_build_dependencies(build_directory):
+    '''
+    Returns the files ninja recorded (from the compilers' dependency output) as
+    inputs of the objects built in ``build_directory``, including the headers
+    the sources include, or ``None`` if they could not be determined.
+    '''
+    try:
+        output = subprocess.check_output(
+            ['ninja', '-t', 'deps'], stderr=subprocess.STDOUT, cwd=build_directory).decode()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    # The dependencies are listed indented below the object they belong to.
+    return sorted(set(os.path.join(build_directory, line.strip())
+                      for line in output.splitlines() if line.startswith(' ') and line.strip()))
+
+
+def _get_dependency_mtimes(dependencies):
+    if dependencies is None:
+        return None
+    try:
+        return {path: os.stat(path).st_mtime_ns for path in dependencies}
+    except OSError:
+        return None
+
+
+def _update_jit_manifest(name, build_directory, digest, dependencies):
+    manifest = _read_jit_manifest(build_directory)
+    manifest[name] = {
+        'digest': digest,
+        'dependencies': _get_dependency_mtimes(dependencies),
+    }
+    manifest_path = os.path.join(build_directory, JIT_EXTENSION_MANIFEST)
+    # Write to a temporary file first so that readers never see a partially
+    # written manifest.
+    temporary_path = '{}.{}'.format(manifest_path, os.getpid())
+    with open(temporary_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(temporary_path, manifest_path)
+
+
+def _is_jit_build_up_to_date(name, build_directory, digest):
+    '''
+    Returns ``True`` if the library for the extension module ``name`` exists in
+    ``build_directory``, was last built from inputs matching ``digest`` and none
+    of the dependencies recorded for that build (such as included headers) has
+    been modified or removed since. This mirrors ninja's own check, but without
+    running ninja.
+    '''
+    library_path = os.path.join(build_directory, _get_library_file_name(name))
+    if not os.path.exists(library_path):
+        return False
+    entry = _read_jit_manifest(build_directory).get(name)
+    if not isinstance(entry, dict) or entry.get('digest') != digest:
+        return False
+    dependencies = entry.get('dependencies')
+    # Without known dependencies, only ninja can tell whether we are up to date.
+    if dependencies is None:
+        return False
+    return _get_dependency_mtimes(dependencies) == dependencies
+
+
 def _get_num_workers(verbose):
     max_jobs = os.environ.get('MAX_JOBS')
     if max_jobs is not None and max_jobs.isdigit():
@@ -1392,7 +1700,10 @@ def _get_num_workers(verbose):
 
 
 def _run_ninja_build(build_directory, verbose, error_prefix):
-    command = ['ninja', '-v']
+    # Only print every command when asked to. Even without -v, ninja prints
+    # the full command line of any target that fails to build, which ends up
+    # in the error message below.
+    command = ['ninja', '-v'] if verbose else ['ninja']
     num_workers = _get_num_workers(verbose)
     if num_workers is not None:
         command.extend(['-j', str(num_workers)])
@@ -1435,14 +1746,23 @@ def _run_ninja_build(build_directory, verbose, error_prefix):
 
 
 def _import_module_from_library(module_name, path, is_python_module):
-    # https://stackoverflow.com/questions/67631/how-to-import-a-module-given-the-full-path
-    file, path, description = imp.find_module(module_name, [path])
-    # Close the .so file after load.
-    with file:
-        if is_python_module:
-            return imp.load_module(module_name, file, path, description)
-        else:
-            torch.ops.load_library(path)
+    library_path = os.path.join(path, _get_library_file_name(module_name))
+    if is_python_module:
+        # https://stackoverflow.com/questions/67631/how-to-import-a-module-given-the-full-path
+        spec = importlib.util.spec_from_file_location(module_name, library_path)
+        module = importlib.util.module_from_spec(spec)
+        # Like `import`, make the module available under its name.
+        sys.modules[module_name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            # Don't leave a half-initialized module behind for later imports.
+            del sys.modules[module_name]
+            raise
+        return module
+    else:
+        torch.ops.load_library(library_path)
+        return library_path
 
 
 def _write_ninja_file_to_build_library(path,
@@ -1452,7 +1772,8 @@ def _write_ninja_file_to_build_library(path,
                                        extra_cuda_cflags,
                                        extra_ldflags,
                                        extra_include_paths,
-                                       with_cuda):
+                                       with_cuda,
+                                       unity_build=False):
     extra_cflags = [flag.strip() for flag in extra_cflags]
     extra_cuda_cflags = [flag.strip() for flag in extra_cuda_cflags]
     extra_ldflags = [flag.strip() for flag in extra_ldflags]
@@ -1484,10 +1805,11 @@ def _write_ninja_file_to_build_library(path,
         from distutils.spawn import _nt_quote_args
         cflags = _nt_quote_args(cflags)
     else:
-        cflags = common_cflags + ['-fPIC', '-std=c++14'] + extra_cflags
+        fpic_flags = [] if '-fPIC' in extra_cflags else ['-fPIC']
+        cflags = common_cflags + fpic_flags + ['-std=c++14'] + extra_cflags
 
     if with_cuda and IS_HIP_EXTENSION:
-        cuda_flags = ['-DWITH_HIP'] + cflags + COMMON_HIPCC_FLAGS
+        cuda_flags = ['-DWITH_HIP'] + cflags + [flag for flag in COMMON_HIPCC_FLAGS if flag not in cflags]
         cuda_flags += extra_cuda_cflags
         cuda_flags += _get_rocm_arch_flags(cuda_flags)
         sources = [s if not _is_cuda_file(s) else
@@ -1502,17 +1824,31 @@ def _write_ninja_file_to_build_library(path,
             cuda_flags = _nt_quote_args(cuda_flags)
             cuda_flags += _nt_quote_args(extra_cuda_cflags)
         else:
-            cuda_flags += ['--compiler-options', "'-fPIC'"]
+            cuda_flags += _get_nvcc_fpic_flags(extra_cuda_cflags)
             cuda_flags += extra_cuda_cflags
             if not any(flag.startswith('-std=') for flag in cuda_flags):
                 cuda_flags.append('-std=c++14')
+        cuda_flags += _get_nvcc_thread_flags(_join_cuda_home('bin', 'nvcc'), cuda_flags)
     else:
         cuda_flags = None
 
+    if unity_build:
+        cpp_sources = [s for s in sources if not (with_cuda and _is_cuda_file(s))]
+        if len(cpp_sources) > 1:
+            unity_source = os.path.join(os.path.dirname(path), 'unity.cpp')
+            _maybe_write(unity_source, ''.join(
+                '#include "{}"\n'.format(os.path.abspath(s).replace('\\', '/'))
+                for s in cpp_sources))
+            sources = [unity_source] + [s for s in sources if s not in cpp_sources]
+
     def object_file_path(source_file):
-        # '/path/to/file.cpp' -> 'file'
-        file_name = os.path.splitext(os.path.basename(source_file))[0]
-        if _is_cuda_file(source_file) and with_cuda:
+        # '/path/to/file.cpp' -> 'file_<hash>', where the hash of the full path
+        # keeps sources with the same filename in different directories from
+        # overwriting each other's objects.
+        file_name = '{}_{}'.format(
+            os.path.splitext(os.path.basename(source_file))[0],
+            hashlib.sha1(os.path.abspath(source_file).encode()).hexdigest()[:8])
+        if with_cuda and _is_cuda_file(source_file):
             # Use a different object filename in case a C++ and CUDA file have
             # the same filename but different extension (.cpp vs. .cu).
             target = '{}.cuda.o'.format(file_name)
@@ -1532,8 +1868,7 @@ def _write_ninja_file_to_build_library(path,
     elif IS_WINDOWS:
         ldflags = _nt_quote_args(ldflags)
 
-    ext = 'pyd' if IS_WINDOWS else 'so'
-    library_target = '{}.{}'.format(name, ext)
+    library_target = _get_library_file_name(name)
 
     _write_ninja_file(
         path=path,
@@ -1593,6 +1928,10 @@ def _write_ninja_file(path,
     else:
         compiler = os.environ.get('CXX', 'c++')
 
+    # Prefix for compile (but not link) commands, e.g. 'ccache '.
+    launcher = _get_compiler_launcher()
+    launcher = '' if launcher is None else launcher + ' '
+
     # Version 1.3 is required for the `deps` directive.
     config = ['ninja_required_version = 1.3']
     config.append('cxx = {}'.format(compiler))
@@ -1617,24 +1956,56 @@ def _write_ninja_file(path,
     # See https://ninja-build.org/build.ninja.html for reference.
     compile_rule = ['rule compile']
     if IS_WINDOWS:
+        # With many include paths, the command line may exceed the 32K
+        # character limit of the Windows command line, so pass the flags via
+        # a response file instead.
         compile_rule.append(
-            '  command = cl /showIncludes $cflags -c $in /Fo$out $post_cflags')
+            '  command = cl /showIncludes @$out.rsp -c $in /Fo$out $post_cflags')
+        compile_rule.append('  rspfile = $out.rsp')
+        compile_rule.append('  rspfile_content = $cflags')
         compile_rule.append('  deps = msvc')
     else:
         compile_rule.append(
-            '  command = $cxx -MMD -MF $out.d $cflags -c $in -o $out $post_cflags')
+            '  command = {}$cxx -MMD -MF $out.d $cflags -c $in -o $out $post_cflags'.format(launcher))
         compile_rule.append('  depfile = $out.d')
         compile_rule.append('  deps = gcc')
+    # Re-stat objects after compiling, so that if a compile left its object
+    # untouched (e.g. a compiler launcher that only rewrites changed outputs)
+    # ninja does not relink the library.
+    compile_rule.append('  restat = 1')
 
+    nvcc_pool = []
     if with_cuda:
         cuda_compile_rule = ['rule cuda_compile']
-        cuda_compile_rule.append(
-            '  command = $nvcc $cuda_cflags -c $in -o $out $cuda_post_cflags')
+        if IS_HIP_EXTENSION:
+            cuda_compile_rule.append(
+                '  command = $nvcc $cuda_cflags -c $in -o $out $cuda_post_cflags')
+        elif (_get_nvcc_version(nvcc) or (0, 0)) >= (10, 2):
+            # Have nvcc emit the headers each source depends on (supported from
+            # CUDA 10.2 onwards), so that CUDA sources are only recompiled when
+            # they or their headers changed. For JIT builds, these dependencies
+            # also end up in the manifest, see _get_ninja_build_dependencies.
+            cuda_compile_rule.append(
+                '  command = {}$nvcc --generate-dependencies-with-compile --dependency-output $out.d '
+                '$cuda_cflags -c $in -o $out $cuda_post_cflags'.format(launcher))
+            cuda_compile_rule.append('  depfile = $out.d')
+            cuda_compile_rule.append('  deps = gcc')
+        else:
+            cuda_compile_rule.append(
+                '  command = {}$nvcc $cuda_cflags -c $in -o $out $cuda_post_cflags'.format(launcher))
+        cuda_compile_rule.append('  restat = 1')
+        # When each nvcc invocation runs on several threads, running as many
+        # of them at once as ninja would by default oversubscribes the CPUs.
+        nvcc_threads = _get_nvcc_thread_count(cuda_cflags + cuda_post_cflags)
+        if nvcc_threads > 1:
+            nvcc_pool = ['pool nvcc_pool']
+            nvcc_pool.append('  depth = {}'.format(max(1, (os.cpu_count() or 1) // nvcc_threads)))
+            cuda_compile_rule.append('  pool = nvcc_pool')
 
     # Emit one build rule per source to enable incremental build.
     build = []
     for source_file, object_file in zip(sources, objects):
-        is_cuda_source = _is_cuda_file(source_file) and with_cuda
+        is_cuda_source = with_cuda and _is_cuda_file(source_file)
         rule = 'cuda_compile' if is_cuda_source else 'compile'
         if IS_WINDOWS:
             source_file = source_file.replace(':', '$:')
@@ -1652,8 +2023,10 @@ def _write_ninja_file(path,
             else:
                 raise RuntimeError("MSVC is required to load C++ extensions")
             link_rule.append(
-                '  command = "{}/link.exe" $in /nologo $ldflags /out:$out'.format(
+                '  command = "{}/link.exe" @$out.rsp /nologo /out:$out'.format(
                     cl_path))
+            link_rule.append('  rspfile = $out.rsp')
+            link_rule.append('  rspfile_content = $in $ldflags')
         else:
             link_rule.append('  command = $cxx $in $ldflags -o $out')
 
@@ -1666,12 +2039,31 @@ def _write_ninja_file(path,
     # 'Blocks' should be separated by newlines, for visual benefit.
     blocks = [config, flags, compile_rule]
     if with_cuda:
+        # The pool has to be declared before the rule using it.
+        if nvcc_pool:
+            blocks.append(nvcc_pool)
         blocks.append(cuda_compile_rule)
     blocks += [link_rule, build, link, default]
-    with open(path, 'w') as build_file:
-        for block in blocks:
-            lines = '\n'.join(block)
-            build_file.write('{}\n\n'.format(lines))
+    content = ''.join('{}\n\n'.format('\n'.join(block)) for block in blocks)
+    _maybe_write(path, content)
+
+
+def _maybe_write(filename, new_content):
+    '''
+    Equivalent to writing the content into the file, but does not touch the
+    file if it already has the right content (to avoid triggering rebuilds and
+    needless I/O).
+    '''
+    if os.path.exists(filename):
+        with open(filename) as f:
+            content = f.read()
+
+        if content == new_content:
+            # The file already contains the right thing!
+            return
+
+    with open(filename, 'w') as f:
+        f.write(new_content)
 
 
 def _join_cuda_home(*paths):
@@ -1681,14 +2073,26 @@ def _join_cuda_home(*paths):
     This is basically a lazy way of raising an error for missing $CUDA_HOME
     only once we need to get any CUDA-specific path.
     '''
-    if CUDA_HOME is None:
+    cuda_home = _get_cuda_home()
+    if cuda_home is None:
         raise EnvironmentError('CUDA_HOME environment variable is not set. '
                                'Please set it to your CUDA install root.')
-    return os.path.join(CUDA_HOME, *paths)
+    return os.path.join(cuda_home, *paths)
+
+
+def _get_cuda_home():
+    # CUDA_HOME is only a global if it was assigned to (by users overriding it,
+    # or eagerly on Python < 3.7). Otherwise it is found on first use.
+    if 'CUDA_HOME' in globals():
+        return globals()['CUDA_HOME']
+    return _find_cuda_home()
+
+
+def __getattr__(name):
+    if name == 'CUDA_HOME':
+        return _get_cuda_home()
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
 
 def _is_cuda_file(path):
-    valid_ext = ['.cu', '.cuh']
-    if IS_HIP_EXTENSION:
-        valid_ext.append('.hip')
-    return os.path.splitext(path)[1] in valid_ext
+    return os.path.splitext(path)[1] in _CUDA_FILE_EXTENSIONS